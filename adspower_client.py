@@ -4,23 +4,61 @@ AdsPower API Client
 Provides interface for starting/stopping browser profiles via AdsPower Local API.
 """
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Optional
+import socket
 import time
 
 
+class SocketOptionsAdapter(HTTPAdapter):
+    """HTTPAdapter with TCP_NODELAY and SO_KEEPALIVE on pooled sockets."""
+    
+    SOCKET_OPTIONS = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    ]
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
 class AdsPowerClient:
     """Client for AdsPower Local API."""
     
-    def __init__(self, base_url: str = "http://localhost:50325"):
+    def __init__(self, base_url: str = "http://localhost:50325", pool_size: int = 32):
         """
         Initialize AdsPower client.
         
         Args:
             base_url: AdsPower Local API base URL
+            pool_size: Max pooled connections (should be >= 2x worker threads)
         """
         self.base_url = base_url.rstrip("/")
         self.session = requests.Session()
+        
+        # Pool sized for concurrent workers, retry transient AdsPower errors,
+        # no Nagle delay on tiny localhost requests
+        adapter = SocketOptionsAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(["GET"])
+            )
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Connection"] = "keep-alive"
+    
+    def close(self):
+        """Close HTTP session and release pooled connections."""
+        self.session.close()
     
     def start_profile(self, serial_number: str, headless: bool = False) -> dict:
         """
@@ -39,13 +77,16 @@ class AdsPowerClient:
         url = f"{self.base_url}/api/v1/browser/start"
         params = {
             "serial_number": serial_number,
-            "headless": "1" if headless else "0"
+            "headless": "1" if headless else "0",
+            # Keep HTTP cache between sessions for faster page loads
+            "clear_cache_after_closing": "0",
+            "cdp_mask": "1"
         }
         
         try:
             response = self.session.get(url, params=params, timeout=60)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data.get("code") == 0:
                 ws_endpoint = data["data"]["ws"]["puppeteer"]
@@ -61,7 +102,7 @@ class AdsPowerClient:
                     "error": f"AdsPower API error: {error_msg}"
                 }
                 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             return {
                 "success": False,
                 "error": f"Request failed: {str(e)}"
@@ -83,7 +124,7 @@ class AdsPowerClient:
         try:
             response = self.session.get(url, params=params, timeout=30)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data.get("code") == 0:
                 return {"success": True}
@@ -93,7 +134,7 @@ class AdsPowerClient:
                     "error": data.get("msg", "Unknown error")
                 }
                 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             return {
                 "success": False,
                 "error": f"Request failed: {str(e)}"
@@ -115,7 +156,7 @@ class AdsPowerClient:
         try:
             response = self.session.get(url, params=params, timeout=15)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data.get("code") == 0:
                 return {
@@ -125,7 +166,7 @@ class AdsPowerClient:
             else:
                 return {"success": True, "active": False}
                 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             return {
                 "success": False,
                 "error": f"Request failed: {str(e)}"
@@ -142,10 +183,13 @@ class AdsPowerClient:
         Returns:
             True if browser is ready, False on timeout
         """
-        start_time = time.time()
-        while time.time() - start_time < timeout:
+        # Poll with exponential backoff (100ms -> 1s)
+        delay = 0.1
+        deadline = time.time() + timeout
+        while time.time() < deadline:
             status = self.check_profile_status(serial_number)
             if status.get("success") and status.get("active"):
                 return True
-            time.sleep(1)
+            time.sleep(max(0.0, min(delay, deadline - time.time())))
+            delay = min(delay * 1.6, 1.0)
         return False
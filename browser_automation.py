@@ -1,13 +1,86 @@
 """
 Browser Automation Module
 
-Handles browser automation using Patchright with AdsPower CDP connection.
+Handles browser automation using Patchright (async API) with AdsPower CDP connection.
 """
 
-from patchright.sync_api import sync_playwright, Page, Browser, BrowserContext
-from typing import Optional, Dict
+from patchright.async_api import async_playwright, Page, Browser, BrowserContext, Locator
+from selectolax.parser import HTMLParser
+from typing import Optional, Dict, List
+import asyncio
+import logging
 import re
 
+logger = logging.getLogger(__name__)
+
+
+# Cards tracked on the collection page (in sheet column order)
+_DEFAULT_CARDS = (
+    "Daruma Zama",
+    "Daruma Monk",
+    "Daruma Wave",
+    "Daruma Devil",
+    "Daruma Fox",
+    "Daruma Lantern",
+    "Daruma Cat",
+    "Daruma Kumo",
+    "Daruma Sakura",
+)
+_VALID_CARDS = frozenset(_DEFAULT_CARDS)
+
+# Page element selectors
+_TICKET_SELECTOR = "a[aria-label='Ticket'] span"
+_PLAY_SELECTOR = "button:has-text('PLAY')"
+_ADD_SELECTOR = "button:has-text('Add to collection')"
+_CARD_SELECTOR = "div.rounded-lg.text-card-foreground"
+
+# Ownership badge text, e.g. "x1", "x2", "x10"
+_BADGE_RE = re.compile(r'^x\d+$', re.IGNORECASE)
+
+# Extracts {title, badges} for every card container in a single evaluate call
+_COLLECTION_JS = """
+() => Array.from(document.querySelectorAll('div.rounded-lg.text-card-foreground')).map(c => ({
+    title: (c.querySelector('h3')?.innerText || '').trim(),
+    badges: Array.from(c.querySelectorAll("span[data-slot='badge']")).map(b => (b.innerText || '').trim())
+}))
+"""
+
+
+def _parse_collection_html(html: str) -> List[dict]:
+    """
+    Extract {title, badges} for every card container from page HTML.
+    
+    Args:
+        html: Collection page HTML
+        
+    Returns:
+        List of dicts in the same shape as _COLLECTION_JS results
+    """
+    tree = HTMLParser(html)
+    entries = []
+    for card in tree.css(_CARD_SELECTOR):
+        title_node = card.css_first("h3")
+        entries.append({
+            "title": _node_text(title_node) if title_node else "",
+            "badges": [_node_text(b) for b in card.css("span[data-slot='badge']")]
+        })
+    return entries
+
+
+def _node_text(node) -> str:
+    """Node text with whitespace collapsed, like innerText.trim()."""
+    # text(strip=True) would glue split text nodes ("Daruma" + " Zama")
+    return " ".join(node.text().split())
+
+
+def _has_ownership_badge(badges) -> bool:
+    """Check if any badge text matches the "xN" ownership pattern."""
+    for badge_text in badges:
+        # Cheap prefix check before the regex
+        if badge_text.startswith(('x', 'X')) and _BADGE_RE.match(badge_text):
+            return True
+    return False
+
 
 class BrowserAutomation:
     """Browser automation for Zashapon game."""
@@ -26,12 +99,22 @@ class BrowserAutomation:
         self.element_wait_timeout = config.get("element_wait_timeout", 30000)
         self.animation_max_wait = config.get("animation_max_wait", 120)
         
+        # Optional CSS selectors for buttons, text selectors are the fallback
+        selectors = config.get("selectors") or {}
+        self.play_selector = selectors.get("play", _PLAY_SELECTOR)
+        self.add_selector = selectors.get("add_to_collection", _ADD_SELECTOR)
+        
         self._playwright = None
         self._browser: Optional[Browser] = None
         self._context: Optional[BrowserContext] = None
         self._page: Optional[Page] = None
+        
+        # Locators are lazy references, cached once per connected page
+        self._loc_ticket: Optional[Locator] = None
+        self._loc_play: Optional[Locator] = None
+        self._loc_add: Optional[Locator] = None
     
-    def connect(self, cdp_endpoint: str) -> bool:
+    async def connect(self, cdp_endpoint: str) -> bool:
         """
         Connect to AdsPower browser via CDP.
         
@@ -42,36 +125,44 @@ class BrowserAutomation:
             True if connection successful
         """
         try:
-            self._playwright = sync_playwright().start()
-            self._browser = self._playwright.chromium.connect_over_cdp(cdp_endpoint)
+            self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.connect_over_cdp(cdp_endpoint)
             
-            # Get existing context (AdsPower profile)
+            # Attach to existing context (AdsPower profile) so cookies, storage
+            # and HTTP cache are reused; a fresh context would start cold
             contexts = self._browser.contexts
-            if contexts:
-                self._context = contexts[0]
-            else:
-                self._context = self._browser.new_context()
+            if not contexts:
+                logger.warning("No AdsPower browser context found")
+                return False
+            self._context = contexts[0]
             
             # Get or create page
             pages = self._context.pages
             if pages:
                 self._page = pages[0]
             else:
-                self._page = self._context.new_page()
+                self._page = await self._context.new_page()
+            
+            self._loc_ticket = self._page.locator(_TICKET_SELECTOR).first
+            self._loc_play = self._page.locator(self.play_selector)
+            self._loc_add = self._page.locator(self.add_selector)
             
             return True
             
         except Exception as e:
-            print(f"Failed to connect to browser: {e}")
+            logger.warning(f"Failed to connect to browser: {e}")
             return False
     
-    def close(self):
+    async def close(self):
         """Close browser connection."""
         try:
+            # Disconnect browser and stop Playwright concurrently (best-effort)
+            pending = []
             if self._browser:
-                self._browser.close()
+                pending.append(self._browser.close())
             if self._playwright:
-                self._playwright.stop()
+                pending.append(self._playwright.stop())
+            await asyncio.gather(*pending, return_exceptions=True)
         except Exception:
             pass
         finally:
@@ -79,8 +170,28 @@ class BrowserAutomation:
             self._context = None
             self._page = None
             self._playwright = None
+            self._loc_ticket = None
+            self._loc_play = None
+            self._loc_add = None
     
-    def navigate_to_game(self) -> bool:
+    def _use_text_selectors(self) -> bool:
+        """
+        Switch Play/Add locators to the text-based default selectors.
+        
+        Returns:
+            True if locators were switched, False if already using them
+        """
+        if self.play_selector == _PLAY_SELECTOR and self.add_selector == _ADD_SELECTOR:
+            return False
+        
+        logger.warning("Configured button selectors not found, falling back to text selectors")
+        self.play_selector = _PLAY_SELECTOR
+        self.add_selector = _ADD_SELECTOR
+        self._loc_play = self._page.locator(_PLAY_SELECTOR)
+        self._loc_add = self._page.locator(_ADD_SELECTOR)
+        return True
+    
+    async def navigate_to_game(self) -> bool:
         """
         Navigate to the game page and wait for it to load.
         
@@ -91,20 +202,21 @@ class BrowserAutomation:
             return False
         
         try:
-            self._page.goto(
+            # Return as soon as the response is received; the ticket counter
+            # wait below covers page readiness
+            await self._page.goto(
                 self.base_url, 
-                wait_until="networkidle",
+                wait_until="commit",
                 timeout=self.page_load_timeout
             )
-            # Additional wait for dynamic content
-            self._page.wait_for_timeout(2000)
+            await self._loc_ticket.wait_for(state="visible", timeout=self.page_load_timeout)
             return True
             
         except Exception as e:
-            print(f"Navigation failed: {e}")
+            logger.warning(f"Navigation failed: {e}")
             return False
     
-    def get_ticket_count(self) -> int:
+    async def get_ticket_count(self) -> int:
         """
         Get the current number of tickets.
         
@@ -116,29 +228,35 @@ class BrowserAutomation:
         
         try:
             # Wait for ticket element to be visible
-            ticket_locator = self._page.locator("a[aria-label='Ticket'] span").first
-            ticket_locator.wait_for(state="visible", timeout=self.element_wait_timeout)
+            await self._loc_ticket.wait_for(state="visible", timeout=self.element_wait_timeout)
             
-            ticket_text = ticket_locator.inner_text()
+            ticket_text = await self._loc_ticket.inner_text()
             ticket_count = int(ticket_text.strip())
             return ticket_count
             
         except Exception as e:
-            print(f"Could not get ticket count: {e}")
+            logger.warning(f"Could not get ticket count: {e}")
             return 0
     
-    def is_play_button_visible(self) -> bool:
-        """Check if Play button is visible and enabled."""
+    async def wait_for_play_ready(self) -> bool:
+        """
+        Wait for the Play button to be visible again on the current page.
+        
+        Returns:
+            True if button is visible, False on timeout
+        """
         if not self._page:
             return False
         
         try:
-            play_button = self._page.locator("button:has-text('PLAY')")
-            return play_button.is_visible() and play_button.is_enabled()
-        except Exception:
+            await self._loc_play.wait_for(state="visible", timeout=self.element_wait_timeout)
+            return True
+            
+        except Exception as e:
+            logger.warning(f"Play button not ready: {e}")
             return False
     
-    def click_play(self) -> bool:
+    async def click_play(self) -> bool:
         """
         Click the Play button.
         
@@ -149,16 +267,20 @@ class BrowserAutomation:
             return False
         
         try:
-            play_button = self._page.locator("button:has-text('PLAY')")
-            play_button.wait_for(state="visible", timeout=self.element_wait_timeout)
-            play_button.click()
+            # click() auto-waits for the button to be visible and enabled
+            try:
+                await self._loc_play.click(timeout=self.element_wait_timeout)
+            except Exception:
+                if not self._use_text_selectors():
+                    raise
+                await self._loc_play.click(timeout=self.element_wait_timeout)
             return True
             
         except Exception as e:
-            print(f"Failed to click Play: {e}")
+            logger.warning(f"Failed to click Play: {e}")
             return False
     
-    def wait_for_add_to_collection(self) -> bool:
+    async def wait_for_add_to_collection(self) -> bool:
         """
         Wait for game animation to complete and "Add to collection" button to appear.
         
@@ -170,18 +292,22 @@ class BrowserAutomation:
         
         try:
             # Wait for "Add to collection" button to appear
-            add_button = self._page.locator("button:has-text('Add to collection')")
-            add_button.wait_for(
-                state="visible", 
-                timeout=self.animation_max_wait * 1000
-            )
+            try:
+                await self._loc_add.wait_for(
+                    state="visible", 
+                    timeout=self.animation_max_wait * 1000
+                )
+            except Exception:
+                if not self._use_text_selectors():
+                    raise
+                await self._loc_add.wait_for(state="visible", timeout=self.element_wait_timeout)
             return True
             
         except Exception as e:
-            print(f"Add to collection button not found: {e}")
+            logger.warning(f"Add to collection button not found: {e}")
             return False
     
-    def click_add_to_collection(self) -> bool:
+    async def click_add_to_collection(self) -> bool:
         """
         Click the "Add to collection" button.
         
@@ -192,37 +318,36 @@ class BrowserAutomation:
             return False
         
         try:
-            add_button = self._page.locator("button:has-text('Add to collection')")
-            add_button.wait_for(state="visible", timeout=self.element_wait_timeout)
-            add_button.click()
+            # click() auto-waits for the button to be visible and enabled
+            await self._loc_add.click(timeout=self.element_wait_timeout)
             
-            # Wait for animation after adding to collection
-            self._page.wait_for_timeout(2000)
+            # Wait for the button to go away once the card is added
+            await self._loc_add.wait_for(state="hidden", timeout=self.element_wait_timeout)
             return True
             
         except Exception as e:
-            print(f"Failed to click Add to collection: {e}")
+            logger.warning(f"Failed to click Add to collection: {e}")
             return False
     
-    def play_game_once(self) -> bool:
+    async def play_game_once(self) -> bool:
         """
         Play one round of the game (Play -> wait -> Add to collection).
         
         Returns:
             True if round completed successfully
         """
-        if not self.click_play():
+        if not await self.click_play():
             return False
         
-        if not self.wait_for_add_to_collection():
+        if not await self.wait_for_add_to_collection():
             return False
         
-        if not self.click_add_to_collection():
+        if not await self.click_add_to_collection():
             return False
         
         return True
     
-    def navigate_to_collection(self) -> bool:
+    async def navigate_to_collection(self) -> bool:
         """
         Navigate to the collection page.
         
@@ -233,24 +358,29 @@ class BrowserAutomation:
             return False
         
         try:
-            self._page.goto(
+            await self._page.goto(
                 self.collection_url,
-                wait_until="networkidle",
+                wait_until="domcontentloaded",
                 timeout=self.page_load_timeout
             )
-            # Wait for collection cards to load
-            self._page.wait_for_timeout(3000)
+            # Wait for the first collection card instead of network idle
+            await self._page.locator(_CARD_SELECTOR).first.wait_for(
+                state="visible",
+                timeout=self.element_wait_timeout
+            )
             return True
             
         except Exception as e:
-            print(f"Navigation to collection failed: {e}")
+            logger.warning(f"Navigation to collection failed: {e}")
             return False
     
-    def get_collection_cards(self) -> Dict[str, bool]:
+    async def get_collection_cards(self) -> Dict[str, bool]:
         """
         Parse collection page and determine which cards are owned.
         
         Cards with "xN" badge are owned, cards without are not.
+        The page HTML is snapshotted once and parsed with selectolax;
+        a single page.evaluate call is used as fallback.
         
         Returns:
             Dict mapping card name to ownership status
@@ -258,58 +388,29 @@ class BrowserAutomation:
         if not self._page:
             return {}
         
-        cards = {
-            "Daruma Zama": False,
-            "Daruma Monk": False,
-            "Daruma Wave": False,
-            "Daruma Devil": False,
-            "Daruma Fox": False,
-            "Daruma Lantern": False,
-            "Daruma Cat": False,
-            "Daruma Kumo": False,
-            "Daruma Sakura": False
-        }
+        cards = dict.fromkeys(_DEFAULT_CARDS, False)
         
         try:
-            # Find all card containers
-            card_containers = self._page.locator("div.rounded-lg.text-card-foreground")
-            count = card_containers.count()
+            try:
+                entries = _parse_collection_html(await self._page.content())
+            except Exception as e:
+                logger.warning(f"HTML snapshot parse failed, using evaluate: {e}")
+                # Collect titles and badge texts of all cards in one round-trip
+                entries = await self._page.evaluate(_COLLECTION_JS)
             
-            for i in range(count):
-                card = card_containers.nth(i)
-                
-                try:
-                    # Get card title
-                    title_element = card.locator("h3")
-                    if not title_element.count():
-                        continue
-                    
-                    card_title = title_element.first.inner_text().strip()
-                    
-                    if card_title not in cards:
-                        continue
-                    
-                    # Check for "xN" badge (indicates ownership)
-                    # Badge contains text like "x1", "x2", etc.
-                    badge_locator = card.locator("span[data-slot='badge']")
-                    badge_count = badge_locator.count()
-                    
-                    for j in range(badge_count):
-                        badge = badge_locator.nth(j)
-                        badge_text = badge.inner_text().strip()
-                        
-                        # Check if badge matches pattern "xN" (e.g., x1, x2, x10)
-                        if re.match(r'^x\d+$', badge_text, re.IGNORECASE):
-                            cards[card_title] = True
-                            break
-                            
-                except Exception:
+            for entry in entries:
+                card_title = entry.get("title", "")
+                if card_title not in _VALID_CARDS:
                     continue
+                
+                # Card is owned if it has an "xN" badge (e.g., x1, x2, x10)
+                if _has_ownership_badge(entry.get("badges", [])):
+                    cards[card_title] = True
             
             return cards
             
         except Exception as e:
-            print(f"Failed to parse collection: {e}")
+            logger.warning(f"Failed to parse collection: {e}")
             return cards
     
     @property
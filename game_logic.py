@@ -4,20 +4,46 @@ Game Logic Module
 Contains the main game automation logic for processing a single profile.
 """
 
-import threading
-from typing import Dict, Tuple
+import asyncio
+import logging
+import logging.handlers
+import multiprocessing
+import signal
+from typing import Dict, Optional, Tuple
 from adspower_client import AdsPowerClient
 from browser_automation import BrowserAutomation
-import time
 
-# Global shutdown flag for graceful termination
-shutdown_flag = threading.Event()
+logger = logging.getLogger(__name__)
 
+# Global shutdown flag for graceful termination (shared with worker processes)
+shutdown_flag = multiprocessing.Event()
 
-def process_profile(
+
+def init_worker(flag, log_queue):
+    """
+    Initializer for worker processes.
+    
+    Installs the parent's shutdown flag, routes log records to the parent's
+    listener and leaves Ctrl+C handling to the parent.
+    
+    Args:
+        flag: Shutdown event created by the parent process
+        log_queue: Queue consumed by the parent's QueueListener
+    """
+    global shutdown_flag
+    shutdown_flag = flag
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+
+
+async def process_profile(
     serial_number: str,
     adspower_client: AdsPowerClient,
-    game_config: dict
+    game_config: dict,
+    known_cards: Optional[Dict[str, bool]] = None
 ) -> Tuple[bool, Dict[str, bool], str]:
     """
     Process a single AdsPower profile.
@@ -35,12 +61,14 @@ def process_profile(
         serial_number: AdsPower profile serial number
         adspower_client: AdsPower API client
         game_config: Game configuration dict
+        known_cards: Cards already recorded in the sheet for this profile
         
     Returns:
         Tuple of (success, cards_dict, status_message)
     """
     automation = None
     cards = {}
+    log = logging.LoggerAdapter(logger, {"serial": serial_number})
     
     try:
         # Check for shutdown before starting
@@ -48,113 +76,126 @@ def process_profile(
             return False, {}, "Shutdown requested"
         
         # Step 1: Start AdsPower profile
-        print(f"[{serial_number}] Starting AdsPower profile...")
-        result = adspower_client.start_profile(serial_number)
+        log.info("Starting AdsPower profile...")
+        result = await asyncio.to_thread(adspower_client.start_profile, serial_number)
         
         if not result.get("success"):
             error_msg = result.get("error", "Failed to start profile")
             return False, {}, f"AdsPower error: {error_msg}"
         
         cdp_endpoint = result["ws_endpoint"]
-        print(f"[{serial_number}] CDP endpoint: {cdp_endpoint}")
+        log.info(f"CDP endpoint: {cdp_endpoint}")
         
         # Wait for browser to be ready
-        time.sleep(3)
+        if not await asyncio.to_thread(adspower_client.wait_for_browser_ready, serial_number):
+            log.warning("Browser not reported active, trying to connect anyway...")
         
         # Step 2: Connect Patchright
-        print(f"[{serial_number}] Connecting Patchright...")
+        log.info("Connecting Patchright...")
         automation = BrowserAutomation(game_config)
         
-        if not automation.connect(cdp_endpoint):
+        if not await automation.connect(cdp_endpoint):
             return False, {}, "Failed to connect Patchright to browser"
         
         # Step 3: Navigate to game
-        print(f"[{serial_number}] Navigating to game...")
-        if not automation.navigate_to_game():
+        log.info("Navigating to game...")
+        if not await automation.navigate_to_game():
             return False, {}, "Failed to navigate to game page"
         
         # Step 4: Check tickets and play
-        ticket_count = automation.get_ticket_count()
-        print(f"[{serial_number}] Tickets: {ticket_count}")
+        ticket_count = await automation.get_ticket_count()
+        log.info(f"Tickets: {ticket_count}")
         
         games_played = 0
         while ticket_count > 0 and not shutdown_flag.is_set():
-            print(f"[{serial_number}] Playing game (tickets remaining: {ticket_count})...")
+            log.info(f"Playing game (tickets remaining: {ticket_count})...")
             
-            if not automation.play_game_once():
-                print(f"[{serial_number}] Game round failed, stopping...")
+            if not await automation.play_game_once():
+                log.warning("Game round failed, stopping...")
                 break
             
             games_played += 1
             
             # Check for shutdown
             if shutdown_flag.is_set():
-                print(f"[{serial_number}] Shutdown requested, stopping...")
+                log.info("Shutdown requested, stopping...")
                 break
             
-            # Navigate back to main page for next game
-            if not automation.navigate_to_game():
-                break
+            # Stay on the same page; reload only if PLAY does not come back
+            if not await automation.wait_for_play_ready():
+                log.warning("Play button not ready, reloading game page...")
+                if not await automation.navigate_to_game():
+                    break
             
             # Get updated ticket count
-            ticket_count = automation.get_ticket_count()
+            ticket_count = await automation.get_ticket_count()
         
-        print(f"[{serial_number}] Played {games_played} games")
+        log.info(f"Played {games_played} games")
+        
+        # Nothing new could have been collected, sheet already has every card
+        if games_played == 0 and known_cards and all(known_cards.values()):
+            log.info("All cards already recorded, skipping collection")
+            return True, dict(known_cards), "Skip: complete"
         
         # Step 5: Navigate to collection
-        print(f"[{serial_number}] Navigating to collection...")
-        if not automation.navigate_to_collection():
+        log.info("Navigating to collection...")
+        if not await automation.navigate_to_collection():
             return False, {}, "Failed to navigate to collection page"
         
         # Step 6: Parse collection
-        print(f"[{serial_number}] Parsing collection...")
-        cards = automation.get_collection_cards()
+        log.info("Parsing collection...")
+        cards = await automation.get_collection_cards()
         
         owned_cards = [name for name, owned in cards.items() if owned]
-        print(f"[{serial_number}] Owned cards: {owned_cards}")
+        log.info(f"Owned cards: {owned_cards}")
         
         return True, cards, f"Success: played {games_played} games"
         
     except Exception as e:
         error_msg = str(e)
-        print(f"[{serial_number}] Error: {error_msg}")
+        log.error(f"Error: {error_msg}")
         return False, cards, f"Error: {error_msg}"
         
     finally:
-        # Step 7: Cleanup
+        # Step 7: Cleanup - stop AdsPower profile while Patchright disconnects
+        cleanup = [asyncio.to_thread(adspower_client.stop_profile, serial_number)]
         if automation:
-            automation.close()
-        
-        # Stop AdsPower profile
-        try:
-            adspower_client.stop_profile(serial_number)
-            print(f"[{serial_number}] Profile stopped")
-        except Exception:
-            pass
+            cleanup.append(automation.close())
+        
+        stopped, *_ = await asyncio.gather(*cleanup, return_exceptions=True)
+        if not isinstance(stopped, BaseException):
+            log.info("Profile stopped")
 
 
 def process_profile_safe(
     serial_number: str,
-    adspower_client: AdsPowerClient,
-    game_config: dict
+    adspower_base_url: str,
+    game_config: dict,
+    known_cards: Optional[Dict[str, bool]] = None
 ) -> Tuple[str, bool, Dict[str, bool], str]:
     """
     Safe wrapper for process_profile that catches all exceptions.
     
+    Runs in a worker process, so it takes only picklable arguments and
+    creates its own AdsPower client and asyncio event loop.
     Returns serial_number as first element for easy result mapping.
     
     Args:
         serial_number: AdsPower profile serial number
-        adspower_client: AdsPower API client
+        adspower_base_url: AdsPower Local API base URL
         game_config: Game configuration dict
+        known_cards: Cards already recorded in the sheet for this profile
         
     Returns:
         Tuple of (serial_number, success, cards_dict, status_message)
     """
+    adspower_client = AdsPowerClient(base_url=adspower_base_url)
     try:
-        success, cards, status = process_profile(
-            serial_number, adspower_client, game_config
-        )
+        success, cards, status = asyncio.run(process_profile(
+            serial_number, adspower_client, game_config, known_cards
+        ))
         return serial_number, success, cards, status
     except Exception as e:
         return serial_number, False, {}, f"Unexpected error: {str(e)}"
+    finally:
+        adspower_client.close()
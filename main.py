@@ -2,19 +2,25 @@
 Zashapon Testnet Automation
 
 Main entry point for the automation software.
-Processes AdsPower profiles with multithreading support.
+Processes AdsPower profiles in parallel worker processes.
 """
 
 import yaml
 import sys
 import signal
-import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict
+import time
+import logging
+import logging.handlers
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Tuple
 
-from adspower_client import AdsPowerClient
 from sheets_manager import SheetsManager
-from game_logic import process_profile_safe, shutdown_flag
+from game_logic import process_profile_safe, init_worker, shutdown_flag
+
+# Flush buffered sheet writes after this many results or seconds
+SHEETS_FLUSH_SIZE = 10
+SHEETS_FLUSH_INTERVAL = 1.0
 
 
 def load_config(config_path: str = "config.yaml") -> dict:
@@ -23,12 +29,99 @@ def load_config(config_path: str = "config.yaml") -> dict:
         return yaml.safe_load(f)
 
 
+class SerialFilter(logging.Filter):
+    """Default the "serial" record field to the worker process name."""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "serial"):
+            record.serial = record.processName
+        return True
+
+
+def setup_logging() -> Tuple[multiprocessing.Queue, logging.handlers.QueueListener]:
+    """
+    Route all log records through a queue drained by a single listener.
+    
+    Workers only enqueue records, so they never contend on the stdout lock.
+    
+    Returns:
+        Tuple of (log_queue, started QueueListener)
+    """
+    log_queue = multiprocessing.Queue()
+    
+    handler = logging.StreamHandler()
+    handler.addFilter(SerialFilter())
+    handler.setFormatter(logging.Formatter("[%(serial)s] %(message)s"))
+    
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.INFO)
+    
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return log_queue, listener
+
+
 def signal_handler(signum, frame):
     """Handle Ctrl+C gracefully."""
     print("\n\n[!] Получен сигнал остановки (Ctrl+C). Завершаем работу...")
     shutdown_flag.set()
 
 
+def write_sheet_updates(
+    sheets_manager: SheetsManager,
+    entries: List[Tuple[str, Dict[str, bool], str]]
+):
+    """
+    Write profile results to Google Sheets in one request.
+    
+    Args:
+        sheets_manager: Google Sheets manager
+        entries: (serial_number, cards, status) entries to write
+    """
+    try:
+        sheets_manager.batch_update(entries)
+    except Exception as e:
+        serials = ", ".join(serial for serial, _, _ in entries)
+        print(f"[!] Failed to update sheet for {serials}: {e}")
+
+
+def finish_sheet_updates(sheets_manager: SheetsManager):
+    """
+    Retry writes left queued by transient failures and report what remains.
+    
+    Args:
+        sheets_manager: Google Sheets manager
+    """
+    try:
+        sheets_manager.flush()
+    except Exception as e:
+        print(f"[!] Failed to update sheet: {e}")
+    
+    unwritten = sheets_manager.pending_ranges
+    if unwritten:
+        print(f"[!] Sheet ranges not written: {', '.join(unwritten)}")
+
+
+def flush_sheet_updates(
+    sheets_executor: ThreadPoolExecutor,
+    sheets_manager: SheetsManager,
+    pending: List[Tuple[str, Dict[str, bool], str]]
+):
+    """
+    Hand buffered profile results to the background sheet writer.
+    
+    Args:
+        sheets_executor: Single-thread executor that owns all sheet writes
+        sheets_manager: Google Sheets manager
+        pending: Buffered (serial_number, cards, status) entries, cleared on return
+    """
+    if not pending:
+        return
+    
+    sheets_executor.submit(write_sheet_updates, sheets_manager, list(pending))
+    pending.clear()
+
 
 def main():
     """Main entry point."""
@@ -49,12 +142,9 @@ def main():
         print(f"[✗] Failed to load config: {e}")
         sys.exit(1)
     
-    # Initialize AdsPower client
+    # AdsPower client is created inside each worker process
     adspower_config = config.get("adspower", {})
-    adspower_client = AdsPowerClient(
-        base_url=adspower_config.get("base_url", "http://localhost:50325")
-    )
-    print("[✓] AdsPower client initialized")
+    adspower_base_url = adspower_config.get("base_url", "http://localhost:50325")
     
     # Initialize Google Sheets manager
     try:
@@ -64,7 +154,8 @@ def main():
             spreadsheet_id=sheets_config.get("spreadsheet_id"),
             sheet_name=sheets_config.get("sheet_name", "Sheet1"),
             columns_config=sheets_config.get("columns", {}),
-            data_start_row=sheets_config.get("data_start_row", 2)
+            data_start_row=sheets_config.get("data_start_row", 2),
+            writes_per_minute=sheets_config.get("writes_per_minute", 60)
         )
         print("[✓] Google Sheets manager initialized")
     except Exception as e:
@@ -83,6 +174,13 @@ def main():
         print(f"[✗] Failed to get profiles: {e}")
         sys.exit(1)
     
+    # Snapshot of cards already recorded, lets complete profiles skip parsing
+    try:
+        owned_cards = sheets_manager.get_owned_cards()
+    except Exception as e:
+        print(f"[!] Failed to read recorded cards: {e}")
+        owned_cards = {}
+    
     # Threading configuration
     threading_config = config.get("threading", {})
     max_workers = threading_config.get("max_workers", 3)
@@ -93,9 +191,20 @@ def main():
     print(f"\n[→] Starting processing with {max_workers} workers...")
     print("-" * 50)
     
-    # Process profiles with thread pool
+    # Process profiles with process pool (one Playwright instance per process)
     results: Dict[str, dict] = {}
-    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending: List[Tuple[str, Dict[str, bool], str]] = []
+    last_flush = time.time()
+    log_queue, log_listener = setup_logging()
+    
+    # Sheet writes run off the main thread so draining futures never waits on
+    # Google; one worker keeps SheetsManager single-threaded and writes ordered
+    sheets_executor = ThreadPoolExecutor(max_workers=1)
+    executor = ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=init_worker,
+        initargs=(shutdown_flag, log_queue)
+    )
     futures = {}
     
     try:
@@ -107,8 +216,12 @@ def main():
             future = executor.submit(
                 process_profile_safe,
                 serial_number,
-                adspower_client,
-                game_config
+                adspower_base_url,
+                game_config,
+                {
+                    card_name: card_name in owned_cards.get(serial_number, ())
+                    for card_name in SheetsManager.CARD_COLUMN_MAP
+                }
             )
             futures[future] = serial_number
         
@@ -117,15 +230,18 @@ def main():
             # Check for shutdown before processing result
             if shutdown_flag.is_set():
                 print("[!] Shutdown requested, canceling pending tasks...")
-                # Cancel all pending futures
-                for f in futures:
-                    f.cancel()
+                # Cancel all pending futures and stop waiting for in-flight ones
+                executor.shutdown(wait=False, cancel_futures=True)
                 break
             
+            if future.cancelled():
+                continue
+            
             serial_number = futures[future]
             
             try:
-                result_serial, success, cards, status = future.result(timeout=1)
+                # Future is already done, result() does not block
+                result_serial, success, cards, status = future.result()
                 results[result_serial] = {
                     "success": success,
                     "cards": cards,
@@ -135,13 +251,8 @@ def main():
                 status_icon = "✓" if success else "✗"
                 print(f"[{status_icon}] {result_serial}: {status}")
                 
-                # Update Google Sheets immediately
-                try:
-                    if success:
-                        sheets_manager.update_collection(result_serial, cards)
-                    sheets_manager.update_status(result_serial, status)
-                except Exception as e:
-                    print(f"[!] Failed to update sheet for {result_serial}: {e}")
+                # Buffer Google Sheets update (cards only on success)
+                pending.append((result_serial, cards if success else {}, status))
                     
             except Exception as e:
                 print(f"[✗] {serial_number}: Exception - {e}")
@@ -150,6 +261,10 @@ def main():
                     "cards": {},
                     "status": f"Exception: {e}"
                 }
+            
+            if len(pending) >= SHEETS_FLUSH_SIZE or time.time() - last_flush > SHEETS_FLUSH_INTERVAL:
+                flush_sheet_updates(sheets_executor, sheets_manager, pending)
+                last_flush = time.time()
     
     except KeyboardInterrupt:
         print("\n[!] KeyboardInterrupt received, stopping...")
@@ -159,6 +274,12 @@ def main():
         # Shutdown executor - cancel pending, don't wait
         print("[i] Shutting down executor...")
         executor.shutdown(wait=False, cancel_futures=True)
+        
+        # Write any buffered results, retry queued ones and wait for the writer
+        flush_sheet_updates(sheets_executor, sheets_manager, pending)
+        sheets_executor.submit(finish_sheet_updates, sheets_manager)
+        sheets_executor.shutdown(wait=True)
+        log_listener.stop()
     
     # Summary
     print("-" * 50)
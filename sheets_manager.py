@@ -5,9 +5,84 @@ Handles reading profile numbers and writing collection data to Google Sheets.
 Uses gspread with service account authentication.
 """
 
+import contextlib
+import functools
+import itertools
+import logging
+import random
+import threading
+import time
 import gspread
+from gspread.exceptions import APIError
 from google.oauth2.service_account import Credentials
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from typing import Any, Callable, List, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Sheets API statuses worth retrying (rate limit and transient server errors)
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+MAX_ATTEMPTS = 6
+BACKOFF_CAP = 32.0
+
+# Max ranges per batch_update request when flushing queued writes
+FLUSH_CHUNK_SIZE = 100
+
+# Default write request budget (Sheets API allows 60 per minute per user)
+WRITES_PER_MINUTE = 60
+
+# Authorized clients and opened spreadsheets shared by all SheetsManager instances
+_CLIENT_CACHE: Dict[str, gspread.Client] = {}
+_SPREADSHEET_CACHE: Dict[Tuple[str, str], gspread.Spreadsheet] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _with_backoff(fn: Callable, *args, **kwargs) -> Any:
+    """
+    Call a Sheets API function, retrying transient errors with backoff.
+    
+    Sleeps min(cap, 2**attempt) plus jitter between attempts, or the
+    server's Retry-After value when present.
+    
+    Args:
+        fn: gspread call to execute
+        *args, **kwargs: Arguments passed to fn
+        
+    Returns:
+        Result of fn
+        
+    Raises:
+        APIError: If status is not retryable or attempts are exhausted
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return fn(*args, **kwargs)
+        except APIError as e:
+            status = e.response.status_code
+            if status not in RETRY_STATUSES or attempt == MAX_ATTEMPTS - 1:
+                raise
+            
+            retry_after = e.response.headers.get("Retry-After")
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = min(BACKOFF_CAP, 2 ** attempt)
+            time.sleep(delay + random.uniform(0, 1))
+
+
+def _is_rejected(exc: BaseException) -> bool:
+    """Check if the API refused a write outright (retrying it cannot succeed)."""
+    return isinstance(exc, APIError) and exc.response.status_code not in RETRY_STATUSES
+
+
+def _chunk(items: List, n: int):
+    """Yield successive lists of at most n items."""
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, n))
+        if not chunk:
+            return
+        yield chunk
 
 
 class SheetsManager:
@@ -19,7 +94,20 @@ class SheetsManager:
         "https://www.googleapis.com/auth/drive"
     ]
     
-    def __init__(self, credentials_file: str, spreadsheet_id: str, sheet_name: str, columns_config: dict, data_start_row: int = 2):
+    # Card name to column key mapping
+    CARD_COLUMN_MAP = {
+        "Daruma Zama": "daruma_zama",
+        "Daruma Monk": "daruma_monk",
+        "Daruma Wave": "daruma_wave",
+        "Daruma Devil": "daruma_devil",
+        "Daruma Fox": "daruma_fox",
+        "Daruma Lantern": "daruma_lantern",
+        "Daruma Cat": "daruma_cat",
+        "Daruma Kumo": "daruma_kumo",
+        "Daruma Sakura": "daruma_sakura"
+    }
+    
+    def __init__(self, credentials_file: str, spreadsheet_id: str, sheet_name: str, columns_config: dict, data_start_row: int = 2, writes_per_minute: int = WRITES_PER_MINUTE, preload: bool = False):
         """
         Initialize Sheets manager.
         
@@ -29,47 +117,170 @@ class SheetsManager:
             sheet_name: Name of the sheet to use
             columns_config: Dict mapping column names to column letters
             data_start_row: First row with data (after headers)
+            writes_per_minute: Budget of write requests, paces flush()
+            preload: Read the sheet now instead of on first lookup
         """
         self.spreadsheet_id = spreadsheet_id
         self.sheet_name = sheet_name
         self.columns_config = columns_config
         self.data_start_row = data_start_row
         
-        # Authenticate and open spreadsheet
-        credentials = Credentials.from_service_account_file(
-            credentials_file, 
-            scopes=self.SCOPES
+        # Authenticate and open spreadsheet (shared across instances)
+        self.client, self.spreadsheet = self._open_spreadsheet(credentials_file, spreadsheet_id)
+        self.worksheet = _with_backoff(self.spreadsheet.worksheet, sheet_name)
+        
+        # Column key -> 1-based column index, resolved once
+        self._col_index = {
+            key: self._column_letter_to_index(letter)
+            for key, letter in columns_config.items()
+        }
+        
+        # Card columns as (col_index, card_name, col_letter), sorted by index
+        self._card_cols = sorted(
+            (self._col_index[key], card_name, columns_config[key])
+            for card_name, key in self.CARD_COLUMN_MAP.items()
+            if key in columns_config
         )
-        self.client = gspread.authorize(credentials)
-        self.spreadsheet = self.client.open_by_key(spreadsheet_id)
-        self.worksheet = self.spreadsheet.worksheet(sheet_name)
         
-        # Cache profile row mapping
+        # Cache profile row mapping (refreshed on miss at most once per TTL)
         self._profile_row_cache: Dict[str, int] = {}
-        self._refresh_profile_cache()
+        self._cache_ts = 0.0
+        self._cache_ttl = 60.0
+        
+        # (row, card_name) -> last known cell value of card columns
+        self._card_state: Dict[Tuple[int, str], str] = {}
+        
+        # Cell writes waiting for flush(); queued while used as a context manager
+        self._pending: List[dict] = []
+        self._pending_cards: List[Tuple[int, Dict[str, bool]]] = []
+        self._buffer_depth = 0
+        
+        # Minimum spacing between write requests
+        self._min_interval = 60.0 / writes_per_minute
+        self._last_write = 0.0
+        
+        # serial_number -> time of last confirmed miss (negative cache)
+        self._neg_cache: Dict[str, float] = {}
+        self._neg_ttl = 300.0
+        
+        # The sheet is read on first lookup unless preloaded
+        self._cache_loaded = False
+        if preload:
+            self._ensure_cache()
+    
+    @classmethod
+    def _open_spreadsheet(cls, credentials_file: str, spreadsheet_id: str) -> Tuple[gspread.Client, gspread.Spreadsheet]:
+        """
+        Get authorized client and opened spreadsheet, reusing cached ones.
+        
+        Args:
+            credentials_file: Path to service account JSON credentials
+            spreadsheet_id: Google Spreadsheet ID
+            
+        Returns:
+            Tuple of (client, spreadsheet)
+        """
+        with _CACHE_LOCK:
+            client = _CLIENT_CACHE.get(credentials_file)
+            if client is None:
+                credentials = Credentials.from_service_account_file(
+                    credentials_file, 
+                    scopes=cls.SCOPES
+                )
+                client = gspread.authorize(credentials)
+                
+                # Larger keep-alive pool for back-to-back API calls; retries are
+                # handled by _with_backoff (gspread 6 keeps the session on http_client)
+                session = getattr(client, "http_client", client).session
+                adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=0)
+                session.mount("https://", adapter)
+                _CLIENT_CACHE[credentials_file] = client
+            
+            key = (credentials_file, spreadsheet_id)
+            spreadsheet = _SPREADSHEET_CACHE.get(key)
+            if spreadsheet is None:
+                spreadsheet = _with_backoff(client.open_by_key, spreadsheet_id)
+                _SPREADSHEET_CACHE[key] = spreadsheet
+        
+        return client, spreadsheet
     
-    def _column_letter_to_index(self, letter: str) -> int:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _column_letter_to_index(letter: str) -> int:
         """Convert column letter (A, B, AA, etc.) to 1-based index."""
         result = 0
         for char in letter.upper():
             result = result * 26 + (ord(char) - ord('A') + 1)
         return result
     
+    def _a1_range(self, start_col: str, end_col: str) -> str:
+        """Build an open-ended A1 range from data_start_row down on this sheet."""
+        sheet = self.sheet_name.replace("'", "''")
+        return f"'{sheet}'!{start_col}{self.data_start_row}:{end_col}"
+    
+    def _card_range(self) -> str:
+        """A1 range spanning all card columns."""
+        return self._a1_range(self._card_cols[0][2], self._card_cols[-1][2])
+    
     def _refresh_profile_cache(self):
-        """Refresh cache of profile serial_numbers to row numbers."""
+        """Refresh cache of profile serial_numbers to row numbers and card state."""
         self._profile_row_cache.clear()
         
         serial_col = self.columns_config.get("serial_number", "A")
-        col_index = self._column_letter_to_index(serial_col)
         
-        # Get all values from serial_number column
-        all_values = self.worksheet.col_values(col_index)
+        # Read serial_number and card columns in one request; the API trims
+        # trailing empty cells
+        ranges = [self._a1_range(serial_col, serial_col)]
+        if self._card_cols:
+            ranges.append(self._card_range())
+        resp = _with_backoff(self.spreadsheet.values_batch_get, ranges)
+        value_ranges = resp.get("valueRanges", [])
         
-        # Map serial_number to row (skip header, start from data_start_row)
-        for i, value in enumerate(all_values):
-            row_num = i + 1  # 1-based row index
-            if row_num >= self.data_start_row and value:
-                self._profile_row_cache[str(value).strip()] = row_num
+        # Map serial_number to row
+        serial_rows = value_ranges[0].get("values", []) if value_ranges else []
+        for offset, values in enumerate(serial_rows):
+            value = str(values[0]).strip() if values else ""
+            if value:
+                self._profile_row_cache[value] = self.data_start_row + offset
+        
+        self._cache_ts = time.monotonic()
+        self._cache_loaded = True
+        
+        card_rows = value_ranges[1].get("values", []) if len(value_ranges) > 1 else []
+        self._load_card_state(card_rows)
+    
+    def _ensure_cache(self):
+        """Read the sheet if no row mapping has been loaded yet."""
+        if not self._cache_loaded:
+            self._refresh_profile_cache()
+    
+    def _load_card_state(self, card_rows: List[list]):
+        """
+        Fill the card state cache from card column values.
+        
+        Args:
+            card_rows: Card range rows starting at data_start_row (may be ragged)
+        """
+        self._card_state.clear()
+        first_index = self._card_cols[0][0] if self._card_cols else 0
+        
+        # Rows and cells past the returned range are empty
+        for row in self._profile_row_cache.values():
+            offset = row - self.data_start_row
+            values = card_rows[offset] if offset < len(card_rows) else []
+            for col_index, card_name, _ in self._card_cols:
+                pos = col_index - first_index
+                self._card_state[(row, card_name)] = str(values[pos]).strip() if pos < len(values) else ""
+    
+    def _remember_cards(self, row: int, cards: Dict[str, bool]):
+        """Record card values written to a row."""
+        for card_name, has_card in cards.items():
+            self._card_state[(row, card_name)] = "ok" if has_card else ""
+    
+    def invalidate(self):
+        """Force the next cache miss to re-read the sheet (e.g. after adding rows)."""
+        self._cache_ts = 0.0
+        self._neg_cache.clear()
     
     def get_profile_numbers(self) -> List[str]:
         """
@@ -93,12 +304,45 @@ class SheetsManager:
             Row number (1-based) or None if not found
         """
         serial_str = str(serial_number).strip()
+        self._ensure_cache()
         
-        if serial_str not in self._profile_row_cache:
-            # Refresh cache and try again
-            self._refresh_profile_cache()
+        if serial_str in self._profile_row_cache:
+            return self._profile_row_cache[serial_str]
+        
+        now = time.monotonic()
+        
+        # Cache is fresh, the profile is simply not in the sheet
+        if now - self._cache_ts < self._cache_ttl:
+            return None
+        
+        # This serial was missing after a recent refresh, don't re-read for it
+        missed_at = self._neg_cache.get(serial_str)
+        if missed_at is not None and now - missed_at < self._neg_ttl:
+            return None
         
-        return self._profile_row_cache.get(serial_str)
+        # Refresh stale cache and try again
+        self._refresh_profile_cache()
+        row = self._profile_row_cache.get(serial_str)
+        if row is None:
+            self._neg_cache[serial_str] = time.monotonic()
+        return row
+    
+    def get_owned_cards(self) -> Dict[str, Set[str]]:
+        """
+        Get recorded cards for all profiles from the card state cache.
+        
+        Returns:
+            Dict mapping serial_number to set of card names marked "ok"
+        """
+        self._ensure_cache()
+        
+        return {
+            serial_number: {
+                card_name for _, card_name, _ in self._card_cols
+                if self._card_state.get((row, card_name), "").lower() == "ok"
+            }
+            for serial_number, row in self._profile_row_cache.items()
+        }
     
     def update_collection(self, serial_number: str, cards: Dict[str, bool]) -> bool:
         """
@@ -113,38 +357,54 @@ class SheetsManager:
         Returns:
             True if update successful, False otherwise
         """
+        if not cards:
+            return True
+        
         row = self.get_row_for_profile(serial_number)
         if row is None:
             return False
         
-        # Card name to column key mapping
-        card_column_map = {
-            "Daruma Zama": "daruma_zama",
-            "Daruma Monk": "daruma_monk",
-            "Daruma Wave": "daruma_wave",
-            "Daruma Devil": "daruma_devil",
-            "Daruma Fox": "daruma_fox",
-            "Daruma Lantern": "daruma_lantern",
-            "Daruma Cat": "daruma_cat",
-            "Daruma Kumo": "daruma_kumo",
-            "Daruma Sakura": "daruma_sakura"
-        }
+        # Nothing to send when every cell already holds the desired value
+        updates = self._build_card_updates(row, cards)
+        if not updates:
+            return True
         
-        # Build list of cell updates
-        updates = []
-        for card_name, has_card in cards.items():
-            column_key = card_column_map.get(card_name)
-            if column_key and column_key in self.columns_config:
-                col_letter = self.columns_config[column_key]
-                cell = f"{col_letter}{row}"
-                value = "ok" if has_card else ""
-                updates.append({"range": cell, "values": [[value]]})
+        self._submit(updates, [(row, cards)])
+        return True
+    
+    def _build_card_updates(self, row: int, cards: Dict[str, bool]) -> List[dict]:
+        """
+        Build cell updates for card columns of a row.
         
-        if updates:
-            # Batch update for efficiency
-            self.worksheet.batch_update(updates)
+        Cells already holding the desired value are skipped; adjacent card
+        columns are merged into one row range (e.g. D5:L5).
         
-        return True
+        Args:
+            row: Row number (1-based)
+            cards: Dict mapping card names to presence (True = has card)
+            
+        Returns:
+            List of {"range", "values"} dicts for worksheet.batch_update
+        """
+        cols = [
+            col for col in self._card_cols
+            if col[1] in cards
+            and self._card_state.get((row, col[1])) != ("ok" if cards[col[1]] else "")
+        ]
+        
+        # Consecutive column indices share the same (index - position) key
+        updates = []
+        for _, run in itertools.groupby(enumerate(cols), key=lambda t: t[1][0] - t[0]):
+            run = [col for _, col in run]
+            values = ["ok" if cards[card_name] else "" for _, card_name, _ in run]
+            first_letter, last_letter = run[0][2], run[-1][2]
+            if first_letter == last_letter:
+                cell_range = f"{first_letter}{row}"
+            else:
+                cell_range = f"{first_letter}{row}:{last_letter}{row}"
+            updates.append({"range": cell_range, "values": [values]})
+        
+        return updates
     
     def update_status(self, serial_number: str, status: str) -> bool:
         """
@@ -164,21 +424,179 @@ class SheetsManager:
         status_col = self.columns_config.get("status_error", "N")
         cell = f"{status_col}{row}"
         
-        self.worksheet.update_acell(cell, status)
+        self._submit([{"range": cell, "values": [[status]]}])
+        return True
+    
+    def _submit(self, updates: List[dict], written_cards: List[Tuple[int, Dict[str, bool]]] = ()):
+        """
+        Send cell updates now, or queue them while buffering.
+        
+        Card values are recorded immediately so later updates in the same
+        buffer are diffed against them; they are forgotten if the write fails.
+        
+        Args:
+            updates: {"range", "values"} dicts for worksheet.batch_update
+            written_cards: (row, cards) pairs the updates write
+        """
+        if not updates:
+            return
+        
+        for row, cards in written_cards:
+            self._remember_cards(row, cards)
+        self._pending_cards.extend(written_cards)
+        self._pending.extend(updates)
+        
+        if not self._buffer_depth:
+            self.flush()
+    
+    def flush(self) -> bool:
+        """
+        Write all queued updates, at most FLUSH_CHUNK_SIZE ranges per request.
+        
+        Requests are paced to stay within the writes-per-minute budget.
+        A chunk the API rejects outright is dropped so it cannot block later
+        writes; after any other failure it stays queued with the rest.
+        
+        Returns:
+            True if the queue was written, False if ranges stay queued for retry
+            
+        Raises:
+            APIError: If the API rejected a chunk (it is dropped)
+        """
+        pending, self._pending = self._pending, []
+        sent = 0
+        try:
+            for chunk in _chunk(pending, FLUSH_CHUNK_SIZE):
+                self._pace()
+                _with_backoff(self.worksheet.batch_update, chunk, value_input_option="RAW")
+                sent += len(chunk)
+        except Exception as e:
+            if _is_rejected(e):
+                rejected = pending[sent:sent + FLUSH_CHUNK_SIZE]
+                logger.warning(f"Dropping {len(rejected)} sheet ranges rejected by the API: {e}")
+                sent += len(rejected)
+            # Keep unsent ranges for the next flush
+            self._pending[:0] = pending[sent:]
+            # Sheet contents of queued card cells are unknown now
+            for row, cards in self._pending_cards:
+                for card_name in cards:
+                    self._card_state.pop((row, card_name), None)
+            if _is_rejected(e):
+                raise
+            logger.warning(f"Keeping {len(self._pending)} sheet ranges queued for retry: {e}")
+            return False
+        finally:
+            self._pending_cards = []
+        
         return True
     
+    @property
+    def pending_ranges(self) -> List[str]:
+        """A1 ranges of queued updates not yet written."""
+        return [update["range"] for update in self._pending]
+    
+    def _pace(self):
+        """Sleep until the minimum interval since the last write has passed."""
+        wait = self._last_write + self._min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_write = time.monotonic()
+    
+    def __enter__(self) -> "SheetsManager":
+        """Start buffering writes until the outermost block exits."""
+        self._buffer_depth += 1
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        """Write everything queued when leaving the outermost block."""
+        self._buffer_depth -= 1
+        if self._buffer_depth:
+            return
+        
+        if exc_type is None:
+            self.flush()
+            return
+        
+        # Don't let a failed flush replace the exception already in flight
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning(f"Failed to flush sheet writes: {e}")
+    
+    @contextlib.contextmanager
+    def batching(self):
+        """
+        Queue updates made inside the block and flush them on exit.
+        
+        Example:
+            with sheets_manager.batching():
+                for serial_number, status in results:
+                    sheets_manager.update_status(serial_number, status)
+        """
+        with self:
+            yield self
+    
+    def write_profile(self, serial_number: str, cards: Dict[str, bool], status: str) -> bool:
+        """
+        Write cards and status for one profile in a single request.
+        
+        Args:
+            serial_number: Profile serial number
+            cards: Dict mapping card names to presence (True = has card)
+            status: Status message to write
+            
+        Returns:
+            True if update successful, False otherwise
+        """
+        return self.batch_update([(serial_number, cards, status)]) == 1
+    
+    def batch_update(self, entries: List[Tuple[str, Dict[str, bool], str]]) -> int:
+        """
+        Write cards and status for multiple profiles in a single request.
+        
+        Args:
+            entries: List of (serial_number, cards, status) tuples
+            
+        Returns:
+            Number of profiles found in the sheet and written
+        """
+        status_col = self.columns_config.get("status_error", "N")
+        
+        updates = []
+        written = []
+        for serial_number, cards, status in entries:
+            row = self.get_row_for_profile(serial_number)
+            if row is None:
+                continue
+            
+            updates.extend(self._build_card_updates(row, cards))
+            updates.append({"range": f"{status_col}{row}", "values": [[status]]})
+            written.append((row, cards))
+        
+        self._submit(updates, written)
+        return len(written)
+    
     def batch_update_collections(self, results: Dict[str, Dict[str, bool]]) -> int:
         """
         Batch update collections for multiple profiles.
         
+        All profiles are written with a single batch_update request.
+        
         Args:
             results: Dict mapping serial_number to cards dict
             
         Returns:
             Number of profiles successfully updated
         """
-        success_count = 0
+        all_updates = []
+        written = []
         for serial_number, cards in results.items():
-            if self.update_collection(serial_number, cards):
-                success_count += 1
-        return success_count
+            row = self.get_row_for_profile(serial_number)
+            if row is None:
+                continue
+            
+            all_updates.extend(self._build_card_updates(row, cards))
+            written.append((row, cards))
+        
+        self._submit(all_updates, written)
+        return len(written)